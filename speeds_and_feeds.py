@@ -1,118 +1,169 @@
 #!/usr/bin/env python3
 
-from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from fractions import Fraction
-from math import pi
+from functools import lru_cache
+from math import floor, log10, pi
+import os
 import numpy as np
-import pint
 
-import matplotlib
-matplotlib.use('PDF')
-from matplotlib.backends.backend_pdf import PdfPages
-import matplotlib.pyplot as plt
-
-ureg = pint.UnitRegistry()
-ureg.define('revolution = 6.2831853 * radian = rev')
+# All the tables below are plain numbers in inches, minutes, revolutions and
+# horsepower, since the plotting math is far too slow to run through a units
+# library.  These are the only conversions needed.
+FT_TO_INCH = 12.0
+INCH_TO_MM = 25.4
 
 # Maximum axial DOC on the X axis as a multiple of tool diameter.  Set to 2 or
 # 3 for substantial utilization of the side of the endmill.  That's rare, so
 # for the purposes of readability use 1.5:
 MAX_DOC_AXIAL = 1.5
 
-# Define your tools here.
+# Stepover (%) ticks for the left axis, which are the same on every page.
+STEPOVER_TICKS = np.arange(0, 101, step=5)
+
+# Define your tools here.  Diameters are in inches.
 tools = [
     {
-        'diameter': 2.0 * ureg.inch,
+        'diameter': 2.0,
         'tooth_count': 1,
         'material': 'HSS/Cobalt',
     },
     {
-        'diameter': 3/4 * ureg.inch,
+        'diameter': 3/4,
         'tooth_count': 4,
         'material': 'HSS/Cobalt',
     },
     {
-        'diameter': 5/8 * ureg.inch,
+        'diameter': 5/8,
         'tooth_count': 4,
         'material': 'HSS/Cobalt',
     },
     {
-        'diameter': 1/2 * ureg.inch,
+        'diameter': 1/2,
         'tooth_count': 4,
         'material': 'HSS/Cobalt',
     },
     {
-        'diameter': 1/2 * ureg.inch,
+        'diameter': 1/2,
         'tooth_count': 4,
         'material': 'Carbide',
     },
     {
-        'diameter': 3/8 * ureg.inch,
+        'diameter': 3/8,
         'tooth_count': 4,
         'material': 'Carbide',
     },
     {
-        'diameter': 3/8 * ureg.inch,
+        'diameter': 3/8,
         'tooth_count': 2,
         'material': 'HSS/Cobalt',
     },
     {
-        'diameter': 3/8 * ureg.inch,
+        'diameter': 3/8,
         'tooth_count': 2,
         'material': 'Carbide',
     },
     {
-        'diameter': 3/16 * ureg.inch,
+        'diameter': 3/16,
         'tooth_count': 2,
         'material': 'Carbide',
     },
 ]
 
-# Define all the materials which are relevant to you.
-materials = OrderedDict([
+# Multiplier applied to each material's SFM, by tool material.  For simplicity,
+# we say carbide tools can sustain double the SFM of HSS tools.  In reality,
+# this varies widely with different material types and tool coatings, but 2x
+# surface speed is a good conservative estimate.  In production environments,
+# some people are running carbide 4-5x.
+SFM_MULTIPLIERS = {
+    'HSS/Cobalt': 1.0,
+    'Carbide': 2.5,
+}
+
+# Precompute each tool's SFM multiplier and its part of the page title, e.g.
+# '3/16" 2 fl. Carbide End Mill'.  Looking up the multiplier here also catches
+# unknown tool materials before any rendering starts.
+for tool in tools:
+    tool['_sfm_multiplier'] = SFM_MULTIPLIERS[tool['material']]
+    tool['_title'] = '{}" {:d} fl. {} End Mill'.format(
+        Fraction(tool['diameter']).limit_denominator(),
+        int(tool['tooth_count']),
+        tool['material'],
+    )
+
+# Render the pages from largest to smallest tool, so that tools sharing a
+# diameter come out on consecutive pages and can share axis setup.  The sort is
+# stable, so tools of the same diameter keep the order they're listed in.
+tools.sort(key=lambda tool: -tool['diameter'])
+
+# Define all the materials which are relevant to you.  SFM is the surface speed
+# (ft/min) to cut them at with an HSS tool, and unit_power is the spindle power
+# (hp) it takes to remove one inch^3/min of them.
+materials = [
     ('Aluminum', {
-        'SFM': 300 * (ureg.ft / ureg.min),
-        'unit_power': 0.4 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 300,
+        'unit_power': 0.4,
         'color': 'xkcd:blue',
         'linestyle': '-',
         'linewidth': 1.5,
     }),
     ('Mild Steel', {
-        'SFM': 100 * (ureg.ft / ureg.min),
-        'unit_power': 1.8 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 100,
+        'unit_power': 1.8,
         'color': 'xkcd:red',
         'linestyle': '-',
         'linewidth': 1.5,
     }),
     ('4130 Steel', {
-        'SFM': 80 * (ureg.ft / ureg.min),
-        'unit_power': 2.2 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 80,
+        'unit_power': 2.2,
         'color': 'xkcd:blue',
         'linestyle': '--',
         'linewidth': 2.0,
     }),
     ('4140 Steel, annealed', {
-        'SFM': 60 * (ureg.ft / ureg.min),
-        'unit_power': 2.3 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 60,
+        'unit_power': 2.3,
         'color': 'xkcd:red',
         'linestyle': '--',
         'linewidth': 1.5,
     }),
     ('4140 Steel, hardened', {
-        'SFM': 30 * (ureg.ft / ureg.min),
-        'unit_power': 2.6 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 30,
+        'unit_power': 2.6,
         'color': 'xkcd:green',
         'linestyle': '--',
         'linewidth': 1.5,
     }),
     ('304 Stainless', {
-        'SFM': 50 * (ureg.ft / ureg.min),
-        'unit_power': 1.8 * (ureg.hp / (ureg.inch**3 / ureg.min)),
+        'SFM': 50,
+        'unit_power': 1.8,
         'color': 'xkcd:black',
         'linestyle': '-.',
         'linewidth': 1.5,
     }),
-])
+]
+
+# Flatten the materials into a table once, with SFM converted to inch/min to
+# match the tool diameters:
+# (name, HSS SFM in inch/min, unit power in hp/(inch^3/min), color, linestyle,
+# linewidth).
+material_table = [
+    (
+        material_name,
+        material_properties['SFM'] * FT_TO_INCH,
+        material_properties['unit_power'],
+        material_properties['color'],
+        material_properties['linestyle'],
+        material_properties['linewidth'],
+    )
+    for material_name, material_properties in materials
+]
+
+# The same SFMs and unit powers as arrays, so the stepover curves for every
+# material can be computed at once.
+material_sfm_ipm = np.array([sfm_ipm for _, sfm_ipm, _, _, _, _ in material_table])
+material_unit_power = np.array([unit_power for _, _, unit_power, _, _, _ in material_table])
 
 # This multiplier gives us our safety buffer.  We're trying to operate the
 # machine below the max ratings, so any calculation errors due to poor
@@ -127,147 +178,270 @@ machine_horsepower_multiplier = 0.5
 # gears/screws.
 machine_efficiency = 0.75
 
+# Define your machines here.  Horsepower is the motor's rating, feed_max is in
+# inch/min, and spindle speeds (either the top of a variable speed range, or
+# each step of a step-pulley) are in RPM.
 machines = [
     {
         'name': 'Sharp LMV CNC Mill',
-        'horsepower': 3.0 * ureg.hp,
-        'feed_max': 60 * ureg.inch / ureg.min,
-        'vari_speed_max': 3000 * ureg.rev / ureg.min,
+        'horsepower': 3.0,
+        'feed_max': 60,
+        'vari_speed_max': 3000,
     },
     {
         'name': 'Bridgeport J-Head Mill',
-        'horsepower': 1.0 * ureg.hp,
-        'feed_max': 30 * ureg.inch / ureg.min,
-        'speeds': [80, 135, 210, 325, 660, 1115, 1750, 2720] * ureg.rev / ureg.min,
+        'horsepower': 1.0,
+        'feed_max': 30,
+        'speeds': [80, 135, 210, 325, 660, 1115, 1750, 2720],
     },
 ]
 
+# Precompute the sorted speeds of each step-pulley machine for
+# closest_machine_speed() to search.
+for machine in machines:
+    if 'speeds' in machine:
+        machine['_speeds_rpm'] = np.sort(np.array(machine['speeds'], dtype=float))
+
 def closest_machine_speed(speed, machine):
     """
-    For a given ideal spindle speed, return the nearest one which is physically
-    possible.
+    For an array of ideal spindle speeds in RPM, return the nearest ones (also
+    in RPM) which are physically possible.
     """
     if 'speeds' in machine:
-        return min(machine['speeds'], key=lambda x: abs(x-speed))
+        # Pick between the available speeds either side of each ideal one,
+        # preferring the slower on a tie.  Clamping the index handles ideal
+        # speeds outside the available range.
+        speeds = machine['_speeds_rpm']
+        i = np.clip(np.searchsorted(speeds, speed), 1, len(speeds) - 1)
+        slower = speeds[i-1]
+        faster = speeds[i]
+        return np.where(speed - slower <= faster - speed, slower, faster)
     else:
-        if speed > machine['vari_speed_max']:
-            return machine['vari_speed_max']
-        else:
-            return speed
+        return np.minimum(speed, machine['vari_speed_max'])
 
-for machine in machines:
+def stepover_curves(inv_doc_axial, d_in, tooth_count, sfm_ipm, MRR_in3pm, machine, out=None):
+    """
+    For a tool of diameter d_in (inch) with tooth_count teeth, cutting several
+    materials at the surface speeds in the array sfm_ipm (inch/min) and target
+    MRRs in the array MRR_in3pm (inch^3/min) on the given machine, return
+    (stepover, speed_rpm, feed_ipm): one row per material of the max stepover in
+    % of the tool diameter at each axial DOC whose reciprocal (1/inch) is given
+    in inv_doc_axial, and for each material the spindle speed and feed to run
+    at.
+
+    If given, the stepover is written into out, which must be a (materials x
+    DOC) float array, instead of a newly allocated one.
+    """
+    speed_rpm = closest_machine_speed(sfm_ipm / (pi * d_in), machine)
+    feed_ipm = np.minimum(0.005 * d_in * speed_rpm * tooth_count, machine['feed_max'])
+
+    # Fold all the per-material scalar factors together first so the curves
+    # cost a single broadcast multiply.
+    stepover = np.multiply(
+        (100.0 * MRR_in3pm / (feed_ipm * d_in))[:, np.newaxis],
+        inv_doc_axial[np.newaxis, :],
+        out=out,
+    )
+
+    return stepover, speed_rpm, feed_ipm
+
+@lru_cache(maxsize=None)
+def axis_ticks(d_in):
+    """
+    For a tool diameter in inches, return the axial DOC ticks and labels for
+    the bottom axis and the radial DOC ticks and labels for the right axis, as
+    (xticks, xticklabels, yticks, yticklabels).  Labels are in inch [mm].
+
+    Several tools share a diameter, so the results are cached.
+    """
+    # Pick a 1/2/5 x 10^n x axis tick step which gives us roughly 8-16 ticks
+    # across the axis.
+    x_max = MAX_DOC_AXIAL * d_in
+    raw_tick_step = x_max / 8
+    tick_exponent = floor(log10(raw_tick_step))
+    tick_mantissa = raw_tick_step / 10**tick_exponent
+    if tick_mantissa < 2:
+        tick_step = 10**tick_exponent
+    elif tick_mantissa < 5:
+        tick_step = 2 * 10**tick_exponent
+    else:
+        tick_step = 5 * 10**tick_exponent
+    xticks = np.arange(0, x_max, tick_step)
+    xticklabels = [
+        '{:.3f}\n[{:.2f}]'.format(tick, tick_mm)
+        for tick, tick_mm in zip(xticks, xticks * INCH_TO_MM)
+    ]
+
+    yticks = np.arange(0, d_in*1.05, step=d_in*0.05)
+    yticklabels = [
+        '{:.3f} [{:.2f}]'.format(tick, tick_mm)
+        for tick, tick_mm in zip(yticks, yticks * INCH_TO_MM)
+    ]
+
+    return xticks, xticklabels, yticks, yticklabels
+
+@lru_cache(maxsize=None)
+def pdf_backend():
+    """
+    Select the matplotlib backend to render with, and return its multi-page PDF
+    writer class.
+
+    matplotlib is only imported here, when something is actually rendered, so
+    that importing this module for its tables or stepover_curves() doesn't pay
+    for it.  The result is cached because the backend can only be chosen once
+    per process.
+    """
+    import matplotlib
+    try:
+        # mplcairo renders these pages considerably faster than matplotlib's
+        # own pure-Python PDF backend.  It's optional though, so fall back to
+        # the stock backend if it isn't installed.
+        from mplcairo.multipage import MultiPage as PdfPages
+        matplotlib.use('module://mplcairo.base')
+    except ImportError:
+        matplotlib.use('PDF')
+        from matplotlib.backends.backend_pdf import PdfPages
+    return PdfPages
+
+def render_machine(machine):
+    """
+    Render one page per tool for the given machine into that machine's PDF.
+    """
+    PdfPages = pdf_backend()
+    import matplotlib.pyplot as plt
 
     machine_filename_suffix = machine['name'].replace(' ', '_')
 
+    target_spindle_horsepower = machine['horsepower'] * machine_horsepower_multiplier * machine_efficiency
+
+    # The machine's part of every page title.
+    machine_title = 'Rough Milling  •  {} {:.1f} hp, {:.0f}% load'.format(
+        machine['name'],
+        machine['horsepower'],
+        machine_horsepower_multiplier * 100,
+    )
+
+    # The target MRR (inch^3/min) for each material depends only on the
+    # machine, not the tool.
+    material_MRR_in3pm = target_spindle_horsepower / material_unit_power
+
+    # Building a figure and its twin axes is expensive, so build them once per
+    # machine and redraw every page on top of them.  ax_top and ax_right hold
+    # no artists, only limits and ticks which depend on nothing but the tool
+    # diameter, so only the main axes need clearing between pages.
+    fig, ax = plt.subplots(figsize=(11.0, 8.0))
+    ax_top = ax.twiny()
+    # The right axis only relabels the left one in physical units, which
+    # ax.secondary_yaxis() would do more cheaply, but that needs matplotlib
+    # 3.1 or later.
+    ax_right = ax.twinx()
+    ax_right.set_ylabel('Radial DOC (inch [mm])')
+    prev_d_in = None
+    stepover_buf = None
+
     with PdfPages('speeds_and_feeds_{}.pdf'.format(machine_filename_suffix)) as pdf:
 
         # Add a new graph on a new page for each different tool.
         for tool in tools:
-            # X axis values
-            doc_axial = np.arange(0.0, MAX_DOC_AXIAL * tool['diameter'].to(ureg.inch).magnitude + 0.01, 0.01) * ureg.inch
+            d_in = tool['diameter']
+            max_doc_axial_in = MAX_DOC_AXIAL * d_in
+            xticks, xticklabels, yticks, yticklabels = axis_ticks(d_in)
 
-            fig, ax = plt.subplots(figsize=(11.0, 8.0))
+            # X axis values (inch), spaced roughly every 0.01" and always
+            # ending exactly on the right edge of the plot.
+            doc_axial = np.linspace(0.0, max_doc_axial_in, int(round(max_doc_axial_in / 0.01)) + 1)
+            # Every material's stepover curve is a scalar over doc_axial, so
+            # take the reciprocal once and multiply for each material.  The
+            # stepover at zero DOC is unbounded, so leave that point as NaN
+            # (which matplotlib doesn't draw) rather than dividing by zero.
+            inv_doc_axial = np.full_like(doc_axial, np.nan)
+            np.reciprocal(doc_axial, out=inv_doc_axial, where=doc_axial > 0)
 
-            # Add vertical line which represents 1D axial DOC for visual
-            # reference.
-            #ax.axvline(tool['diameter'].to(ureg.inch).magnitude, color='black', linestyle='--', linewidth=1.0)
-            ax_top = ax.twiny()
-            ax_top.set_xlim(0, MAX_DOC_AXIAL * tool['diameter'].to(ureg.inch).magnitude)
-            ax_top.set_xticks([tool['diameter'].to(ureg.inch).magnitude, 1.5 * tool['diameter'].to(ureg.inch).magnitude])
-            ax_top.set_xticklabels(['1D', '1.5D'])
+            sfm_multiplier = tool['_sfm_multiplier']
 
-            # Plot a new line for each different type of material.
-            for material_name, material_properties in materials.items():
-                SFM = material_properties['SFM']
+            ax.clear()
+
+            # Tools are sorted by diameter, so consecutive pages often share
+            # the same twin axes setup.
+            if d_in != prev_d_in:
+                ax_top.set_xlim(0, max_doc_axial_in)
+                ax_top.set_xticks([d_in, 1.5 * d_in])
+                ax_top.set_xticklabels(['1D', '1.5D'])
 
-                # For simplicity, we say carbide tools can sustain double the SFM
-                # of HSS tools.  In reality, this varies widely with different
-                # material types and tool coatings, but 2x surface speed is a good
-                # conservative estimate.  In production environments, some people
-                # are running carbide 4-5x.
-                if tool['material'] is 'Carbide':
-                    SFM *= 2.5
+                # Setup secondary axis on right side of graph to show physical
+                # stepover.
+                ax_right.set_ylim(0, d_in)
+                ax_right.set_yticks(yticks)
+                ax_right.set_yticklabels(yticklabels)
 
-                speed = SFM / ( pi * tool['diameter'] / ureg.rev )
-                speed = closest_machine_speed(speed, machine)
+                prev_d_in = d_in
 
-                feed = 0.005 * tool['diameter'] * speed * (tool['tooth_count'] / ureg.rev)
-                if feed > machine['feed_max']:
-                    feed = machine['feed_max']
+            # Add vertical line which represents 1D axial DOC for visual
+            # reference.
+            #ax.axvline(d_in, color='black', linestyle='--', linewidth=1.0)
 
-                target_spindle_horsepower = machine['horsepower'] * machine_horsepower_multiplier * machine_efficiency
-                MRR = target_spindle_horsepower / material_properties['unit_power']
-                doc_radial = MRR / feed / doc_axial
-                stepover = 100 * (doc_radial / tool['diameter']).to(ureg.dimensionless)
+            # Work out the curves for every material at once, reusing the
+            # previous page's output buffer when the DOC grid is the same size.
+            # The previous page has already been saved and cleared by now, so
+            # overwriting its curves is safe.
+            if stepover_buf is None or stepover_buf.shape[1] != len(doc_axial):
+                stepover_buf = np.empty((len(material_table), len(doc_axial)))
+            stepover, speed_rpm, feed_ipm = stepover_curves(
+                inv_doc_axial,
+                d_in,
+                tool['tooth_count'],
+                material_sfm_ipm * sfm_multiplier,
+                material_MRR_in3pm,
+                machine,
+                out=stepover_buf,
+            )
 
+            # Plot a new line for each different type of material.
+            for i, (material_name, _, _, color, linestyle, linewidth) in enumerate(material_table):
                 ax.plot(
                     doc_axial,
-                    stepover,
+                    stepover[i],
                     label='{}: {:.0f} RPM, {:.0f} IPM'.format(
                         material_name,
-                        speed.to(ureg.rev / ureg.min).magnitude,
-                        feed.to(ureg.inch / ureg.min).magnitude,
+                        speed_rpm[i],
+                        feed_ipm[i],
                     ),
-                    color=material_properties['color'],
-                    linestyle=material_properties['linestyle'],
-                    linewidth=material_properties['linewidth'],
+                    color=color,
+                    linestyle=linestyle,
+                    linewidth=linewidth,
                 )
 
             ax.legend()
 
             ax.set(xlabel='Axial DOC (inch [mm])', ylabel='Max Stepover (%)')
             ax.set_title(
-                'Rough Milling  •  {} {:.1f} hp, {:.0f}% load  •  {}" {:d} fl. {} End Mill'.format(
-                    machine['name'],
-                    machine['horsepower'].magnitude,
-                    machine_horsepower_multiplier * 100,
-                    Fraction(tool['diameter'].magnitude).limit_denominator(),
-                    int(tool['tooth_count']),
-                    tool['material'],
-                ),
+                '{}  •  {}'.format(machine_title, tool['_title']),
                 y=1.05, # this just manually places the title to not overlap with the top ticks.
             )
 
             # X limits are proportional to tool diameter.
-            ax.set_xlim(0, MAX_DOC_AXIAL * tool['diameter'].to(ureg.inch).magnitude)
-
-            # Do some magic to get perfect x axis tick granularity.
-            tick_step = 0.0001
-            for _ in range(10):
-                if tick_step*10 > ax.get_xlim()[1]/8:
-                    tick_step *= 5
-                    break
-                if tick_step*20 > ax.get_xlim()[1]/8:
-                    tick_step *= 10
-                    break
-                if tick_step*50 > ax.get_xlim()[1]/8:
-                    tick_step *= 20
-                    break
-                tick_step *= 10
-            xticks = np.arange(0, ax.get_xlim()[1], tick_step)
+            ax.set_xlim(0, max_doc_axial_in)
+
             ax.set_xticks(xticks)
-            ax.set_xticklabels([
-                '{:.3f}\n[{:.2f}]'.format(tick, (tick * ureg.inch).to(ureg.mm).magnitude)
-                for tick in xticks
-            ])
+            ax.set_xticklabels(xticklabels)
             # Limit display up to 100% stepover since that's the entire diameter of
             # the endmill (i.e. slot milling).
             ax.set_ylim(0, 100)
-            ax.set_yticks(np.arange(0, 101, step=5))
+            ax.set_yticks(STEPOVER_TICKS)
 
             ax.grid()
 
-            # Setup secondary axis on right side of graph to show physical stepover.
-            ax_right = ax.twinx()
-            ax_right.set_ylim(0, tool['diameter'].magnitude)
-            yticks = np.arange(0, tool['diameter'].magnitude*1.05, step=tool['diameter'].magnitude*0.05)
-            ax_right.set_yticks(yticks)
-            ax_right.set_yticklabels([
-                '{:.3f} [{:.2f}]'.format(
-                    tick,
-                    (tick * ureg.inch).to(ureg.mm).magnitude
-                ) for tick in yticks])
-            ax_right.set_ylabel('Radial DOC (inch [mm])')
-
             fig.tight_layout()  # otherwise the right y-label is slightly clipped
             pdf.savefig(fig)
+
+    plt.close(fig)
+
+def main():
+    # Every machine gets its own independent PDF, so render them in parallel,
+    # choosing the backend as each worker starts up.
+    max_workers = min(len(machines), os.cpu_count() or 1)
+    with ProcessPoolExecutor(max_workers=max_workers, initializer=pdf_backend) as executor:
+        list(executor.map(render_machine, machines))
+
+if __name__ == '__main__':
+    main()